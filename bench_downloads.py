@@ -0,0 +1,104 @@
+import argparse
+import base64
+import io
+import os
+import statistics
+import tempfile
+import time
+
+# Telegram responses are streamed to the bot in pieces of roughly this size.
+DOWNLOAD_CHUNK = 64 * 1024
+
+def _chunks(payload: bytes):
+    for start in range(0, len(payload), DOWNLOAD_CHUNK):
+        yield payload[start:start + DOWNLOAD_CHUNK]
+
+def _download_to_drive(payload: bytes, path: str):
+    """Mimics File.download_to_drive(): the response is written to a file piece by piece."""
+    with open(path, "wb") as f:
+        for chunk in _chunks(payload):
+            f.write(chunk)
+
+def _download_to_memory(payload: bytes) -> io.BytesIO:
+    """Mimics File.download_to_memory(): the response is written into a buffer, which is rewound."""
+    buffer = io.BytesIO()
+    for chunk in _chunks(payload):
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+def _read_consumer(path=None, buffer=None):
+    """What call_gemini_ocr does for images: base64-encode the whole file."""
+    if buffer is None:
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read())
+    return base64.b64encode(buffer.getbuffer())
+
+def _fitz_consumer(path=None, buffer=None):
+    """What call_gemini_ocr does for PDFs."""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open(stream=buffer.getbuffer(), filetype="pdf") if buffer is not None else fitz.open(path)
+    page_count = len(doc)
+    doc.close()
+    return page_count
+
+def _partition_consumer(path=None, buffer=None, file_name=None):
+    """What call_unstructured_partition does."""
+    from unstructured.partition.auto import partition
+
+    if buffer is not None:
+        return partition(file=buffer, metadata_filename=file_name)
+    return partition(filename=path)
+
+def _time_paths(payload: bytes, file_name: str, directory: str, consumer, runs: int):
+    """Times the old disk path and the in-memory path, each from download to processed input."""
+    disk, memory = [], []
+    for _ in range(runs):
+        path = os.path.join(directory, file_name)
+        start = time.perf_counter()
+        try:
+            _download_to_drive(payload, path)
+            consumer(path=path)
+        finally:
+            os.remove(path)
+        disk.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        consumer(buffer=_download_to_memory(payload))
+        memory.append(time.perf_counter() - start)
+    return disk, memory
+
+def _report(label: str, disk: list, memory: list):
+    disk_ms = statistics.median(disk) * 1000
+    memory_ms = statistics.median(memory) * 1000
+    print(f"{label:>14}: disk {disk_ms:8.3f}ms  memory {memory_ms:8.3f}ms  ({disk_ms / max(memory_ms, 1e-9):.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-file I/O time of disk vs in-memory downloads.")
+    parser.add_argument("--sizes", default="0.1,1,5,20", help="Comma-separated synthetic payload sizes in MB.")
+    parser.add_argument("--runs", type=int, default=20, help="Runs per measurement.")
+    parser.add_argument("--dir", default="downloads", help="Directory used for the disk path (e.g. the shared volume).")
+    parser.add_argument("--pdf", help="A PDF to time through fitz.open() from a path vs from a stream.")
+    parser.add_argument("--document", help="A .docx/.pptx to time through unstructured's partition().")
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for size_mb in (float(size) for size in args.sizes.split(",")):
+            payload = os.urandom(int(size_mb * 1024 * 1024))
+            _report(f"read {size_mb:g} MB", *_time_paths(payload, "bench.bin", directory, _read_consumer, args.runs))
+
+        if args.pdf:
+            with open(args.pdf, "rb") as f:
+                payload = f.read()
+            _report("fitz.open", *_time_paths(payload, os.path.basename(args.pdf), directory, _fitz_consumer, args.runs))
+
+        if args.document:
+            with open(args.document, "rb") as f:
+                payload = f.read()
+            file_name = os.path.basename(args.document)
+
+            def consumer(path=None, buffer=None):
+                return _partition_consumer(path, buffer, file_name)
+            _report("partition", *_time_paths(payload, file_name, directory, consumer, args.runs))
@@ -0,0 +1,86 @@
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+import chromadb
+
+from knowledge_base import TenantRegistry, user_collection_name, shard_collection_name
+
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2
+
+def _random_embeddings(count: int) -> list:
+    return [[random.random() for _ in range(EMBEDDING_DIM)] for _ in range(count)]
+
+def _percentiles(samples: list) -> str:
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    return f"p50={p50 * 1000:.2f}ms p95={p95 * 1000:.2f}ms"
+
+def bench_per_user(path: str, tenants: int, chunks: int, queries: int):
+    """One collection per tenant; lookup by scanning list_collections as the bot used to."""
+    client = chromadb.PersistentClient(path=path)
+    start = time.perf_counter()
+    for user_id in range(tenants):
+        collection = client.get_or_create_collection(name=user_collection_name(user_id), embedding_function=None)
+        collection.add(ids=[f"{user_id}-{i}" for i in range(chunks)], embeddings=_random_embeddings(chunks),
+                       documents=[f"chunk {i}" for i in range(chunks)])
+    print(f"[per_user] loaded {tenants} tenants in {time.perf_counter() - start:.1f}s")
+
+    lookups, latencies = [], []
+    for _ in range(queries):
+        user_id = random.randrange(tenants)
+        start = time.perf_counter()
+        name = next(c.name for c in client.list_collections() if c.name == user_collection_name(user_id))
+        lookups.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        client.get_collection(name=name).query(query_embeddings=_random_embeddings(1), n_results=4)
+        latencies.append(time.perf_counter() - start)
+    print(f"[per_user] lookup (list scan): {_percentiles(lookups)}")
+    print(f"[per_user] query:              {_percentiles(latencies)}")
+
+def bench_shared(path: str, tenants: int, chunks: int, queries: int, shard_count: int):
+    """Sharded shared collections filtered by user_id; lookup through the tenant registry."""
+    client = chromadb.PersistentClient(path=path)
+    registry = TenantRegistry(f"{path}/tenant_registry.sqlite3")
+    start = time.perf_counter()
+    for user_id in range(tenants):
+        name = shard_collection_name(user_id, shard_count)
+        collection = client.get_or_create_collection(name=name, embedding_function=None)
+        collection.add(ids=[f"{user_id}-{i}" for i in range(chunks)], embeddings=_random_embeddings(chunks),
+                       documents=[f"chunk {i}" for i in range(chunks)],
+                       metadatas=[{"user_id": user_id} for _ in range(chunks)])
+        registry.register(user_id, name, "shared")
+    print(f"[shared]   loaded {tenants} tenants into {shard_count} shards in {time.perf_counter() - start:.1f}s")
+
+    lookups, latencies = [], []
+    for _ in range(queries):
+        user_id = random.randrange(tenants)
+        start = time.perf_counter()
+        name = registry.get(user_id)
+        lookups.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        client.get_collection(name=name).query(query_embeddings=_random_embeddings(1), n_results=4,
+                                               where={"user_id": user_id})
+        latencies.append(time.perf_counter() - start)
+    print(f"[shared]   lookup (registry):  {_percentiles(lookups)}")
+    print(f"[shared]   query:              {_percentiles(latencies)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark query latency of the tenant layouts.")
+    parser.add_argument("--tenants", type=int, default=10000, help="Number of simulated users.")
+    parser.add_argument("--chunks", type=int, default=20, help="Chunks stored per user.")
+    parser.add_argument("--queries", type=int, default=200, help="Number of timed queries.")
+    parser.add_argument("--shards", type=int, default=16, help="Shard count for the shared layout.")
+    parser.add_argument("--layout", choices=["per_user", "shared", "both"], default="both")
+    args = parser.parse_args()
+
+    # Each run uses a throwaway directory so it never touches ./chroma_data.
+    if args.layout in ("per_user", "both"):
+        with tempfile.TemporaryDirectory() as path:
+            bench_per_user(path, args.tenants, args.chunks, args.queries)
+    if args.layout in ("shared", "both"):
+        with tempfile.TemporaryDirectory() as path:
+            bench_shared(path, args.tenants, args.chunks, args.queries, args.shards)
@@ -7,4 +7,32 @@ load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
\ No newline at end of file
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# --- Knowledge Base Layout ---
+# "per_user": one Chroma collection per user (user_<id>).
+# "shared": users are spread over TENANT_SHARD_COUNT shared collections and
+# isolated by a `user_id` metadata filter.
+TENANT_LAYOUT = os.getenv("TENANT_LAYOUT", "per_user")
+TENANT_SHARD_COUNT = int(os.getenv("TENANT_SHARD_COUNT", "16"))
+
+# --- Knowledge Base Eviction ---
+# Idle knowledge bases are removed after EVICTION_TTL_DAYS; users over USER_QUOTA_MB lose
+# their oldest documents; above GLOBAL_QUOTA_MB the least recently used knowledge bases go
+# first. A value of 0 disables the corresponding rule. Quotas are compared against an
+# estimate of each document's stored size (text plus float32 embeddings), not against disk
+# usage. Deleting a whole user_<id> collection frees its files; chunks removed from a
+# collection that is kept (trims, and every eviction in the shared layout) stay in Chroma's
+# index files until that collection is rebuilt by exporting it, deleting it and importing it.
+EVICTION_TTL_DAYS = float(os.getenv("EVICTION_TTL_DAYS", "30"))
+USER_QUOTA_MB = float(os.getenv("USER_QUOTA_MB", "50"))
+GLOBAL_QUOTA_MB = float(os.getenv("GLOBAL_QUOTA_MB", "0"))
+EVICTION_INTERVAL_MINUTES = float(os.getenv("EVICTION_INTERVAL_MINUTES", "60"))
+# The background sweep only logs what it would evict unless this is explicitly set to false.
+EVICTION_DRY_RUN = os.getenv("EVICTION_DRY_RUN", "true").lower() in ("1", "true", "yes")
+
+# --- Downloads ---
+# Telegram files up to this size are downloaded into memory and never touch the disk;
+# larger files (or files of unknown size) are spilled to the downloads/bot/ directory.
+# The Bot API only serves files up to 20 MB, so this must stay well below that for
+# large uploads to be spilled instead of held in memory.
+IN_MEMORY_DOWNLOAD_MAX_MB = float(os.getenv("IN_MEMORY_DOWNLOAD_MAX_MB", "5"))
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import logging
+import re
+import time
+from typing import Optional
+
+from chromadb.errors import ChromaError
+
+from config import EVICTION_TTL_DAYS, USER_QUOTA_MB, GLOBAL_QUOTA_MB, EVICTION_INTERVAL_MINUTES, EVICTION_DRY_RUN
+from knowledge_base import LAYOUT_PER_USER, is_shared_collection
+from services import (tenant_registry, document_manifest, clear_vector_store, delete_document, persistent_client,
+                      user_lock, EMBEDDING_DIMENSION)
+
+# --- Logging ---
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+USER_COLLECTION_PATTERN = re.compile(r"^user_(\d+)$")
+# Size assumed for chunks stored before the document manifest existed:
+# a full 1000-character chunk (the text splitter's chunk_size) plus its embedding.
+LEGACY_CHUNK_BYTES = 1000 + EMBEDDING_DIMENSION * 4
+
+def seed_registry() -> int:
+    """
+    Registers users whose user_<id> collection predates the tenant registry, so idle
+    knowledge bases of users who never come back are still subject to eviction.
+
+    Returns:
+        The number of users newly registered.
+    """
+    seeded = 0
+    for collection in persistent_client.list_collections():
+        match = USER_COLLECTION_PATTERN.match(collection.name)
+        if match and tenant_registry.seed(int(match.group(1)), collection.name, LAYOUT_PER_USER):
+            seeded += 1
+    if seeded:
+        logger.info(f"Registered {seeded} existing knowledge bases for eviction tracking.")
+    return seeded
+
+def _estimated_size(tenant: dict, documents: list[dict]) -> int:
+    """Estimates a user's stored bytes from the manifest, or from the chunk count if it has none."""
+    if documents or is_shared_collection(tenant["collection_name"]):
+        return sum(doc["size_bytes"] for doc in documents)
+    try:
+        return persistent_client.get_collection(name=tenant["collection_name"]).count() * LEGACY_CHUNK_BYTES
+    except (ValueError, ChromaError):
+        # The collection is gone; the sweep will drop its registration.
+        return 0
+
+def plan_evictions(now: Optional[float] = None, ttl_days: float = EVICTION_TTL_DAYS,
+                   user_quota_mb: float = USER_QUOTA_MB, global_quota_mb: float = GLOBAL_QUOTA_MB) -> list[dict]:
+    """
+    Decides what to evict, without touching the store.
+    Rules are applied in order: knowledge bases idle for longer than the TTL expire,
+    users over their quota lose their oldest documents, and while the total is over the
+    global quota the least recently used knowledge bases are evicted.
+
+    Returns:
+        A list of actions, each with an "action" of "expire", "trim" or "evict".
+    """
+    now = now or time.time()
+    actions = []
+    remaining = []
+    for tenant in tenant_registry.tenants():
+        documents = document_manifest.usage(tenant["collection_name"], tenant["user_id"])
+        size = _estimated_size(tenant, documents)
+        idle_days = (now - tenant["last_access"]) / 86400
+        if ttl_days and idle_days > ttl_days:
+            actions.append({**tenant, "action": "expire", "size_bytes": size,
+                            "reason": f"idle for {idle_days:.1f} days"})
+            continue
+
+        if user_quota_mb:
+            quota = user_quota_mb * MB
+            # Documents are ordered oldest first; keep the newest one even if it alone exceeds the quota.
+            for doc in documents[:-1]:
+                if size <= quota:
+                    break
+                actions.append({**tenant, "action": "trim", "source": doc["source"], "size_bytes": doc["size_bytes"],
+                                "reason": f"user over quota ({size / MB:.1f} MB > {user_quota_mb:g} MB)"})
+                size -= doc["size_bytes"]
+        remaining.append({**tenant, "size_bytes": size})
+
+    if global_quota_mb:
+        total = sum(tenant["size_bytes"] for tenant in remaining)
+        for tenant in sorted(remaining, key=lambda t: t["last_access"]):
+            if total <= global_quota_mb * MB:
+                break
+            actions.append({**tenant, "action": "evict",
+                            "reason": f"store over quota ({total / MB:.1f} MB > {global_quota_mb:g} MB)"})
+            total -= tenant["size_bytes"]
+    return actions
+
+def format_report(actions: list[dict]) -> str:
+    """Renders a plan as a human-readable dry-run report."""
+    if not actions:
+        return "Nothing to evict."
+    lines = []
+    for action in actions:
+        target = f"user {action['user_id']} in '{action['collection_name']}'"
+        if action["action"] == "trim":
+            target = f"document '{action['source']}' of {target}"
+        lines.append(f"{action['action']:<6} {target}: {action['size_bytes'] / MB:.2f} MB, {action['reason']}")
+    freed = sum(action["size_bytes"] for action in actions)
+    lines.append(f"Total: {len(actions)} actions, ~{freed / MB:.2f} MB")
+    return "\n".join(lines)
+
+def apply_evictions(actions: list[dict]) -> int:
+    """
+    Carries out a plan. Returns the number of actions that succeeded.
+    Each action holds the user's write lock and is skipped if the user was active
+    (or their knowledge base was cleared) after the plan was made.
+    """
+    done = 0
+    for action in actions:
+        try:
+            with user_lock(action["collection_name"], action["user_id"]):
+                last_access = tenant_registry.last_access(action["user_id"])
+                if last_access is None or last_access > action["last_access"]:
+                    logger.info(f"Skipping eviction '{action['action']}' for user {action['user_id']}: "
+                                f"knowledge base changed since the sweep was planned.")
+                    continue
+                if action["action"] == "trim":
+                    delete_document(action["collection_name"], action["source"], action["user_id"])
+                else:
+                    clear_vector_store(action["collection_name"], action["user_id"])
+            done += 1
+        except Exception as e:
+            logger.error(f"Eviction '{action['action']}' failed for user {action['user_id']}: {e}", exc_info=True)
+    return done
+
+def run_eviction(dry_run: bool = EVICTION_DRY_RUN) -> list[dict]:
+    """Plans one eviction sweep, logs the report and applies it unless dry_run is set."""
+    actions = plan_evictions()
+    logger.info(f"Eviction sweep{' (dry run)' if dry_run else ''}:\n{format_report(actions)}")
+    if actions and not dry_run:
+        logger.info(f"Applied {apply_evictions(actions)} of {len(actions)} eviction actions.")
+    return actions
+
+async def eviction_loop(interval_minutes: float = EVICTION_INTERVAL_MINUTES, dry_run: bool = EVICTION_DRY_RUN):
+    """
+    Runs eviction sweeps forever. Each sweep runs in a worker thread so the
+    bot's handlers keep being served while the store is scanned.
+    """
+    try:
+        await asyncio.to_thread(seed_registry)
+    except Exception as e:
+        logger.error(f"Seeding the tenant registry failed: {e}", exc_info=True)
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            await asyncio.to_thread(run_eviction, dry_run)
+        except Exception as e:
+            logger.error(f"Eviction sweep failed: {e}", exc_info=True)
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Evict idle or oversized knowledge bases.")
+    parser.add_argument("--apply", action="store_true", help="Actually evict. Without it, only the report is printed.")
+    args = parser.parse_args()
+    seed_registry()
+    run_eviction(dry_run=not args.apply)
@@ -1,41 +1,282 @@
 import chromadb
 import argparse
+import array
+import base64
+import gzip
+import json
+import os
+import sqlite3
+import time
 
-def inspect_chroma_db(collection_name=None):
+from knowledge_base import DocumentManifest, TenantRegistry, iter_pages
+
+# Every command walks collections in pages of this many records, so memory use
+# does not depend on how large the store is.
+DEFAULT_BATCH_SIZE = 500
+
+# Bookkeeping databases kept next to Chroma's own files, and the table each one holds.
+# Both are keyed by collection_name, so exports carry the rows of the exported collections.
+SIDECAR_TABLES = {
+    "documents": ("document_manifest.sqlite3", DocumentManifest),
+    "tenants": ("tenant_registry.sqlite3", TenantRegistry),
+}
+
+def _selected_collections(client, collection_name=None):
+    """Returns the collections to operate on, optionally restricted to a single name."""
+    collections = client.list_collections()
+    return [client.get_collection(name=c.name) for c in collections if not collection_name or c.name == collection_name]
+
+def inspect_chroma_db(client, collection_name=None, batch_size=DEFAULT_BATCH_SIZE):
     """
-    Connects to the persistent ChromaDB and prints its contents.
+    Prints the contents of the persistent ChromaDB.
     If a collection_name is provided, it will only inspect that collection.
     """
-    try:
-        # Connect to the same persistent client
-        client = chromadb.PersistentClient(path="./chroma_data")
-        
-        print("--- ChromaDB Inspector ---")
-        
-        collections = client.list_collections()
-        if not collections:
-            print("No collections found in the database.")
-            return
-
-        print(f"Found {len(collections)} collections: {[c.name for c in collections]}\n")
-
-        for collection in collections:
-            if collection_name and collection.name != collection_name:
-                continue
-            print(f"--- Inspecting Collection: '{collection.name}' ---")
-            data = collection.get(include=["metadatas", "documents"]) # Get documents and their metadata
-            count = collection.count()
-            print(f"Total documents: {count}\n")
-            for i, doc in enumerate(data.get('documents', [])):
-                print(f"  Document {i+1} (ID: {data['ids'][i]}):")
-                print(f"    Metadata: {data['metadatas'][i]}")
+    print("--- ChromaDB Inspector ---")
+
+    collections = client.list_collections()
+    if not collections:
+        print("No collections found in the database.")
+        return
+
+    print(f"Found {len(collections)} collections: {[c.name for c in collections]}\n")
+
+    for collection in _selected_collections(client, collection_name):
+        print(f"--- Inspecting Collection: '{collection.name}' ---")
+        print(f"Total documents: {collection.count()}\n")
+        i = 0
+        for page in iter_pages(collection, batch_size, ["metadatas", "documents"]):
+            for doc_id, metadata, doc in zip(page["ids"], page["metadatas"], page["documents"]):
+                i += 1
+                print(f"  Document {i} (ID: {doc_id}):")
+                print(f"    Metadata: {metadata}")
                 print(f"    Content: '{doc[:200].replace(chr(10), ' ')}...'\n")
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
+def collection_stats(collection, manifest: DocumentManifest, batch_size=DEFAULT_BATCH_SIZE) -> dict:
+    """
+    Computes size statistics for one collection by streaming over it page by page.
+    Embeddings are never paged; a single record is read to learn their dimension.
+    Per-source counts are not collected here (see print_stats), so memory stays constant.
+    """
+    chunks = 0
+    text_bytes = 0
+    metadata_bytes = 0
+    dimension = None
+    sample = collection.get(limit=1, include=["embeddings"])
+    if sample.get("embeddings") is not None and len(sample["embeddings"]):
+        dimension = len(sample["embeddings"][0])
+    for page in iter_pages(collection, batch_size, ["documents", "metadatas"]):
+        chunks += len(page["ids"])
+        for doc, metadata in zip(page["documents"], page["metadatas"]):
+            text_bytes += len((doc or "").encode("utf-8"))
+            metadata_bytes += len(json.dumps(metadata or {}, ensure_ascii=False).encode("utf-8"))
+    # Embeddings are stored as float32.
+    embedding_bytes = chunks * (dimension or 0) * 4
+    return {
+        "name": collection.name,
+        "chunks": chunks,
+        "bytes": text_bytes + metadata_bytes + embedding_bytes,
+        "text_bytes": text_bytes,
+        "embedding_bytes": embedding_bytes,
+        "dimension": dimension,
+        "last_write": manifest.last_write(collection.name),
+    }
+
+def print_stats(client, manifest: DocumentManifest, collection_name=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Prints per-collection statistics."""
+    for collection in _selected_collections(client, collection_name):
+        stats = collection_stats(collection, manifest, batch_size)
+        last_write = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stats["last_write"])) if stats["last_write"] else "unknown"
+        print(f"--- Collection: '{stats['name']}' ---")
+        print(f"  Chunks: {stats['chunks']}")
+        print(f"  Size: {stats['bytes']} bytes (text {stats['text_bytes']}, embeddings {stats['embedding_bytes']})")
+        print(f"  Embedding dimension: {stats['dimension'] or 'unknown'}")
+        print(f"  Last write: {last_write}")
+        # Streamed from the manifest, so shards with thousands of tenants don't build an in-memory table.
+        print("  Documents:")
+        tracked = 0
+        for source, count in manifest.iter_source_chunks(collection.name):
+            print(f"    {source}: {count} chunks")
+            tracked += count
+        if stats["chunks"] > tracked:
+            print(f"    <not in manifest>: {stats['chunks'] - tracked} chunks")
+        print()
+
+def _encode_embedding(embedding) -> str:
+    return base64.b64encode(array.array("f", embedding).tobytes()).decode("ascii")
+
+def _decode_embedding(encoded: str) -> list:
+    values = array.array("f")
+    values.frombytes(base64.b64decode(encoded))
+    return values.tolist()
+
+def _export_sidecar_rows(out, path: str, collection_names: list):
+    """Streams the manifest and registry rows of the exported collections, one line per row."""
+    for table, (file_name, _) in SIDECAR_TABLES.items():
+        db_path = os.path.join(path, file_name)
+        if not os.path.exists(db_path):
+            continue
+        conn = sqlite3.connect(db_path)
+        try:
+            placeholders = ", ".join("?" for _ in collection_names)
+            cursor = conn.execute(f"SELECT * FROM {table} WHERE collection_name IN ({placeholders})", collection_names)
+            columns = [column[0] for column in cursor.description]
+            count = 0
+            for row in cursor:
+                out.write(json.dumps({"table": table, "row": dict(zip(columns, row))}, ensure_ascii=False) + "\n")
+                count += 1
+            print(f"Exported {count} rows from {file_name}")
+        finally:
+            conn.close()
+
+def export_collections(client, path: str, output_path: str, collection_name=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Streams collections to a gzip-compressed JSON Lines file.
+    Each collection starts with a header line, followed by one line per chunk
+    with its embedding packed as base64-encoded float32. The document manifest
+    and tenant registry rows of those collections are appended at the end.
+    """
+    total = 0
+    exported = []
+    with gzip.open(output_path, "wt", encoding="utf-8") as out:
+        for collection in _selected_collections(client, collection_name):
+            exported.append(collection.name)
+            out.write(json.dumps({"collection": collection.name, "metadata": collection.metadata}) + "\n")
+            count = 0
+            for page in iter_pages(collection, batch_size, ["documents", "metadatas", "embeddings"]):
+                for record_id, doc, metadata, embedding in zip(page["ids"], page["documents"], page["metadatas"], page["embeddings"]):
+                    out.write(json.dumps({"id": record_id, "document": doc, "metadata": metadata,
+                                          "embedding": _encode_embedding(embedding)}, ensure_ascii=False) + "\n")
+                count += len(page["ids"])
+            print(f"Exported {count} chunks from '{collection.name}'")
+            total += count
+        _export_sidecar_rows(out, path, exported)
+    print(f"Exported {total} chunks to {output_path}")
+
+def _open_sidecar(path: str, table: str) -> sqlite3.Connection:
+    """Opens a bookkeeping database for import, creating its schema if needed."""
+    file_name, schema_owner = SIDECAR_TABLES[table]
+    db_path = os.path.join(path, file_name)
+    schema_owner(db_path)
+    return sqlite3.connect(db_path)
+
+def import_collections(client, path: str, input_path: str, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Streams an export file back into the store, upserting chunks in batches and
+    restoring manifest and registry rows. Stop the bot first: it caches the registry.
+    """
+    collection = None
+    batch = []
+    sidecars = {}
+
+    def flush():
+        if batch:
+            collection.upsert(
+                ids=[record["id"] for record in batch],
+                documents=[record["document"] for record in batch],
+                metadatas=[record["metadata"] for record in batch],
+                embeddings=[_decode_embedding(record["embedding"]) for record in batch],
+            )
+            batch.clear()
+
+    total = 0
+    with gzip.open(input_path, "rt", encoding="utf-8") as src:
+        for line in src:
+            record = json.loads(line)
+            if "table" in record:
+                if record["table"] not in sidecars:
+                    sidecars[record["table"]] = _open_sidecar(path, record["table"])
+                row = record["row"]
+                columns = ", ".join(row)
+                placeholders = ", ".join("?" for _ in row)
+                sidecars[record["table"]].execute(
+                    f"INSERT OR REPLACE INTO {record['table']} ({columns}) VALUES ({placeholders})", list(row.values())
+                )
+                continue
+            if "collection" in record:
+                flush()
+                collection = client.get_or_create_collection(
+                    name=record["collection"], metadata=record.get("metadata"), embedding_function=None
+                )
+                print(f"Importing into '{collection.name}'...")
+                continue
+            batch.append(record)
+            total += 1
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    for table, conn in sidecars.items():
+        conn.commit()
+        conn.close()
+        print(f"Restored {SIDECAR_TABLES[table][0]}")
+    print(f"Imported {total} chunks from {input_path}")
+
+def compact_store(client, path: str, collection_name=None, dry_run=False):
+    """
+    Drops empty collections (only collection_name, if given), prunes registry and
+    manifest entries that point at missing collections, then VACUUMs the SQLite
+    files to return freed pages to disk.
+    Stop the bot before running this: VACUUM needs exclusive access to the database.
+    """
+    manifest = DocumentManifest(os.path.join(path, "document_manifest.sqlite3"))
+    registry = TenantRegistry(os.path.join(path, "tenant_registry.sqlite3"))
+
+    remaining = []
+    for collection in _selected_collections(client):
+        if collection_name and collection.name != collection_name:
+            remaining.append(collection.name)
+        elif collection.count() == 0:
+            print(f"Dropping empty collection '{collection.name}'")
+            if not dry_run:
+                client.delete_collection(name=collection.name)
+        else:
+            remaining.append(collection.name)
+
+    if dry_run:
+        return
+
+    print(f"Pruned {manifest.prune(remaining)} stale manifest entries")
+    print(f"Pruned {registry.prune(remaining)} stale tenant registrations")
+    manifest.vacuum()
+    registry.vacuum()
+
+    chroma_db = os.path.join(path, "chroma.sqlite3")
+    if os.path.exists(chroma_db):
+        before = os.path.getsize(chroma_db)
+        conn = sqlite3.connect(chroma_db)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        print(f"Vacuumed {chroma_db}: {before} -> {os.path.getsize(chroma_db)} bytes")
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Inspect ChromaDB.")
-    parser.add_argument("-c", "--collection", help="The name of the collection to inspect.")
+    parser = argparse.ArgumentParser(description="Inspect and maintain ChromaDB.")
+    parser.add_argument("-c", "--collection", help="The name of the collection to operate on.")
+    parser.add_argument("--path", default="./chroma_data", help="The ChromaDB persistence directory.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Records read per page.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("inspect", help="Print the stored chunks (default).")
+    subparsers.add_parser("stats", help="Print per-collection statistics.")
+    export_parser = subparsers.add_parser("export", help="Export collections to a .jsonl.gz file.")
+    export_parser.add_argument("output", help="The file to write.")
+    import_parser = subparsers.add_parser("import", help="Import collections from a .jsonl.gz file.")
+    import_parser.add_argument("input", help="The file to read.")
+    compact_parser = subparsers.add_parser("compact", help="Drop empty collections and vacuum the database.")
+    compact_parser.add_argument("--dry-run", action="store_true", help="Only print what would be dropped.")
     args = parser.parse_args()
-    inspect_chroma_db(args.collection)
\ No newline at end of file
+
+    try:
+        # Connect to the same persistent client
+        client = chromadb.PersistentClient(path=args.path)
+        if args.command == "stats":
+            print_stats(client, DocumentManifest(os.path.join(args.path, "document_manifest.sqlite3")), args.collection, args.batch_size)
+        elif args.command == "export":
+            export_collections(client, args.path, args.output, args.collection, args.batch_size)
+        elif args.command == "import":
+            import_collections(client, args.path, args.input, args.batch_size)
+        elif args.command == "compact":
+            compact_store(client, args.path, args.collection, args.dry_run)
+        else:
+            inspect_chroma_db(client, args.collection, args.batch_size)
+    except Exception as e:
+        print(f"An error occurred: {e}")
@@ -0,0 +1,367 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# --- Logging ---
+logger = logging.getLogger(__name__)
+
+# --- Tenant Layouts ---
+LAYOUT_PER_USER = "per_user"
+LAYOUT_SHARED = "shared"
+SHARD_PREFIX = "kb_shard_"
+
+def user_collection_name(user_id: int) -> str:
+    """Returns the dedicated collection name used by the per-user layout."""
+    return f"user_{user_id}"
+
+def shard_collection_name(user_id: int, shard_count: int) -> str:
+    """Returns the shared collection a user is placed in by the shared layout."""
+    return f"{SHARD_PREFIX}{user_id % shard_count:03d}"
+
+def is_shared_collection(collection_name: str) -> bool:
+    """Whether a collection holds several tenants and must be filtered by user_id."""
+    return collection_name.startswith(SHARD_PREFIX)
+
+def iter_pages(collection, batch_size: int, include: list, where: Optional[dict] = None):
+    """
+    Yields a Chroma collection's records in fixed-size pages, so callers can walk
+    a collection of any size while holding at most one page in memory.
+    """
+    offset = 0
+    while True:
+        page = collection.get(where=where, limit=batch_size, offset=offset, include=include)
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """Adds a column to a table created by an older version of this module."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def estimate_size(chunks: list, dimension: int) -> int:
+    """Estimates the bytes a list of chunks occupies once stored with float32 embeddings."""
+    return sum(len(chunk.encode("utf-8")) for chunk in chunks) + len(chunks) * dimension * 4
+
+# --- Tenant Registry ---
+
+class TenantRegistry:
+    """
+    A small SQLite-backed index mapping each user to the collection that holds
+    their knowledge base. Lookups are served from an in-memory dict, so resolving
+    a user's collection never has to scan Chroma's collection list.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        # Handlers call into the registry from worker threads (asyncio.to_thread).
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tenants ("
+            "user_id INTEGER PRIMARY KEY, "
+            "collection_name TEXT NOT NULL, "
+            "layout TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "last_access REAL)"
+        )
+        _add_column(self._conn, "tenants", "last_access", "REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tenants_collection ON tenants (collection_name)")
+        self._conn.commit()
+        self._cache = {
+            user_id: collection_name
+            for user_id, collection_name in self._conn.execute("SELECT user_id, collection_name FROM tenants")
+        }
+        # Access times are recorded in memory on the hot path and persisted by flush_access().
+        self._pending_access = {}
+        # Guards only the in-memory dict, never held during I/O.
+        self._access_lock = threading.Lock()
+
+    def touch(self, user_id: int):
+        """Marks a user's knowledge base as used now. Cheap enough to call from the event loop."""
+        with self._access_lock:
+            self._pending_access[user_id] = time.time()
+
+    def flush_access(self):
+        """Persists access times recorded by touch()."""
+        with self._access_lock:
+            pending, self._pending_access = self._pending_access, {}
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE tenants SET last_access = ? WHERE user_id = ?",
+                [(accessed_at, user_id) for user_id, accessed_at in pending.items()]
+            )
+            self._conn.commit()
+
+    def tenants(self) -> list[dict]:
+        """Lists every registered user with their collection and last access time (falling back to creation time)."""
+        self.flush_access()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, collection_name, COALESCE(last_access, created_at) FROM tenants"
+            ).fetchall()
+        return [{"user_id": row[0], "collection_name": row[1], "last_access": row[2]} for row in rows]
+
+    def last_access(self, user_id: int) -> Optional[float]:
+        """Returns a user's current last access time (falling back to creation time), or None if unknown."""
+        self.flush_access()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(last_access, created_at) FROM tenants WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, user_id: int) -> Optional[str]:
+        """Returns the collection registered for a user, or None if the user is unknown."""
+        return self._cache.get(user_id)
+
+    def register(self, user_id: int, collection_name: str, layout: str):
+        """Records (or moves) a user's knowledge base to the given collection."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO tenants (user_id, collection_name, layout, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET collection_name = excluded.collection_name, layout = excluded.layout",
+                (user_id, collection_name, layout, time.time())
+            )
+            self._conn.commit()
+            self._cache[user_id] = collection_name
+
+    def seed(self, user_id: int, collection_name: str, layout: str) -> bool:
+        """
+        Registers a user found in an existing collection, unless they are already known.
+        Their last access is set to now, so a store predating the registry gets a full TTL.
+
+        Returns:
+            True if the user was newly registered.
+        """
+        with self._lock:
+            now = time.time()
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO tenants (user_id, collection_name, layout, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_id, collection_name, layout, now, now)
+            )
+            self._conn.commit()
+            if cursor.rowcount:
+                self._cache[user_id] = collection_name
+            return bool(cursor.rowcount)
+
+    def remove(self, user_id: int):
+        """Forgets a user's registration."""
+        with self._lock:
+            self._conn.execute("DELETE FROM tenants WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+            self._cache.pop(user_id, None)
+
+    def remove_collection(self, collection_name: str):
+        """Forgets every user registered to a collection that was deleted."""
+        with self._lock:
+            self._conn.execute("DELETE FROM tenants WHERE collection_name = ?", (collection_name,))
+            self._conn.commit()
+            self._cache = {user_id: name for user_id, name in self._cache.items() if name != collection_name}
+
+    def users_in(self, collection_name: str) -> list[int]:
+        """Lists the users whose knowledge base lives in the given collection."""
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id FROM tenants WHERE collection_name = ?", (collection_name,))
+            return [row[0] for row in rows]
+
+    def prune(self, collection_names: list) -> int:
+        """Forgets users whose collection no longer exists. Returns the number removed."""
+        with self._lock:
+            placeholders = ", ".join("?" for _ in collection_names)
+            cursor = self._conn.execute(
+                f"DELETE FROM tenants WHERE collection_name NOT IN ({placeholders})", list(collection_names)
+            )
+            self._conn.commit()
+            kept = set(collection_names)
+            self._cache = {user_id: name for user_id, name in self._cache.items() if name in kept}
+            return cursor.rowcount
+
+    def vacuum(self):
+        """Reclaims space left by removed registrations."""
+        self.flush_access()
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+# --- Document Manifest ---
+
+def document_id(source: str, user_id: Optional[int] = None) -> str:
+    """Derives a stable id for a document from its owner and source name."""
+    return hashlib.sha256(f"{user_id}:{source}".encode("utf-8")).hexdigest()[:16]
+
+def chunk_ids(doc_id: str, chunks: list) -> list[str]:
+    """
+    Derives deterministic ids for a document's chunks.
+    Each id is built from the document id, the chunk's content hash and the
+    occurrence of that content within the document, so unchanged chunks keep
+    their id when text is inserted or removed elsewhere in a revision.
+    """
+    seen = {}
+    ids = []
+    for chunk in chunks:
+        chunk_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+        occurrence = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = occurrence + 1
+        ids.append(f"{doc_id}-{chunk_hash}-{occurrence}")
+    return ids
+
+def document_hash(chunks: list) -> str:
+    """Hashes a document's full chunk list to detect unchanged re-uploads."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class DocumentManifest:
+    """
+    A SQLite-backed record of which chunk ids make up each stored document,
+    used to diff revisions and to delete a single document by name.
+    """
+
+    # Manifest rows written without a user (plain per-user collections) are stored under this id.
+    NO_USER = 0
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "collection_name TEXT NOT NULL, "
+            "user_id INTEGER NOT NULL, "
+            "source TEXT NOT NULL, "
+            "doc_id TEXT NOT NULL, "
+            "content_hash TEXT NOT NULL, "
+            "chunk_ids TEXT NOT NULL, "
+            "updated_at REAL NOT NULL, "
+            "size_bytes INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (collection_name, user_id, source))"
+        )
+        _add_column(self._conn, "documents", "size_bytes", "INTEGER NOT NULL DEFAULT 0")
+        self._conn.commit()
+
+    def get(self, collection_name: str, source: str, user_id: Optional[int] = None) -> Optional[dict]:
+        """Returns the manifest entry for a document, or None if it is not stored."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc_id, content_hash, chunk_ids, updated_at FROM documents "
+                "WHERE collection_name = ? AND user_id = ? AND source = ?",
+                (collection_name, user_id or self.NO_USER, source)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"doc_id": row[0], "content_hash": row[1], "chunk_ids": json.loads(row[2]), "updated_at": row[3]}
+
+    def put(self, collection_name: str, source: str, doc_id: str, doc_hash: str, ids: list,
+            user_id: Optional[int] = None, size_bytes: int = 0):
+        """Records the current chunk ids and estimated stored size of a document."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents "
+                "(collection_name, user_id, source, doc_id, content_hash, chunk_ids, updated_at, size_bytes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (collection_name, user_id or self.NO_USER, source, doc_id, doc_hash, json.dumps(ids), time.time(), size_bytes)
+            )
+            self._conn.commit()
+
+    def remove(self, collection_name: str, source: str, user_id: Optional[int] = None):
+        """Forgets a single document."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM documents WHERE collection_name = ? AND user_id = ? AND source = ?",
+                (collection_name, user_id or self.NO_USER, source)
+            )
+            self._conn.commit()
+
+    def sources(self, collection_name: str, user_id: Optional[int] = None) -> list[str]:
+        """Lists the documents stored for a user in a collection, most recent first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source FROM documents WHERE collection_name = ? AND user_id = ? ORDER BY updated_at DESC",
+                (collection_name, user_id or self.NO_USER)
+            )
+            return [row[0] for row in rows]
+
+    def usage(self, collection_name: str, user_id: Optional[int] = None) -> list[dict]:
+        """Lists a user's documents with their estimated size, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, size_bytes, updated_at FROM documents "
+                "WHERE collection_name = ? AND user_id = ? ORDER BY updated_at",
+                (collection_name, user_id or self.NO_USER)
+            ).fetchall()
+        return [{"source": row[0], "size_bytes": row[1], "updated_at": row[2]} for row in rows]
+
+    def clear(self, collection_name: str, user_id: Optional[int] = None):
+        """Forgets every document of a user in a collection."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM documents WHERE collection_name = ? AND user_id = ?",
+                (collection_name, user_id or self.NO_USER)
+            )
+            self._conn.commit()
+
+    def clear_collection(self, collection_name: str):
+        """Forgets every document in a collection that was deleted, whoever owned it."""
+        with self._lock:
+            self._conn.execute("DELETE FROM documents WHERE collection_name = ?", (collection_name,))
+            self._conn.commit()
+
+    def iter_source_chunks(self, collection_name: str):
+        """
+        Yields (source, chunk count) for every document in a collection, summed over users.
+        Rows are streamed from SQLite, so memory use does not grow with the number of sources.
+        The lock is held until the generator is exhausted; meant for maintenance tools.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT source, SUM(json_array_length(chunk_ids)) FROM documents "
+                "WHERE collection_name = ? GROUP BY source ORDER BY source",
+                (collection_name,)
+            )
+            for source, count in cursor:
+                yield source, count
+
+    def last_write(self, collection_name: str) -> Optional[float]:
+        """Returns the time any document in a collection was last written, if known."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(updated_at) FROM documents WHERE collection_name = ?", (collection_name,)
+            ).fetchone()
+        return row[0]
+
+    def prune(self, collection_names: list) -> int:
+        """Drops manifest entries of collections that no longer exist. Returns the number removed."""
+        with self._lock:
+            placeholders = ", ".join("?" for _ in collection_names)
+            cursor = self._conn.execute(
+                f"DELETE FROM documents WHERE collection_name NOT IN ({placeholders})", list(collection_names)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def vacuum(self):
+        """Reclaims space left by deleted manifest entries."""
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def move(self, user_id: int, old_collection: str, new_collection: str):
+        """Re-points a user's documents after their chunks were migrated to another collection."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE documents SET collection_name = ? WHERE collection_name = ? AND user_id = ?",
+                (new_collection, old_collection, user_id)
+            )
+            self._conn.commit()
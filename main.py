@@ -1,12 +1,17 @@
+import io
 import logging
 import os
 import asyncio
+from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 
-from config import TELEGRAM_BOT_TOKEN
+from config import TELEGRAM_BOT_TOKEN, EVICTION_INTERVAL_MINUTES, IN_MEMORY_DOWNLOAD_MAX_MB
 from services import (call_gemini_ocr, call_unstructured_partition, call_openrouter_summarize, call_openai_transcribe,
-                      chunk_text, add_to_vector_store, get_rag_answer, clear_vector_store)
+                      chunk_text, add_to_vector_store, get_rag_answer, clear_vector_store, get_user_collection,
+                      find_user_collection,
+                      delete_document, list_documents, tenant_registry)
+from eviction import eviction_loop
 
 # --- Basic Setup ---
 logging.basicConfig(
@@ -27,6 +32,41 @@ AVAILABLE_MODELS = {
 }
 DEFAULT_MODEL = "anthropic/claude-3.5-sonnet"
 
+# Large files are spilled to a subdirectory only the bot writes to, so cleaning it
+# up never touches files other processes keep in the shared downloads/ volume.
+DOWNLOAD_DIR = "downloads/bot"
+
+# --- Download Helpers ---
+
+async def _download(file, spill_path: str) -> Optional[io.BytesIO]:
+    """
+    Downloads a Telegram file into memory if it is under IN_MEMORY_DOWNLOAD_MAX_MB,
+    otherwise (or if its size is unknown) writes it to spill_path.
+    Callers must remove spill_path in a `finally` block, even if the download fails.
+
+    Returns:
+        A buffer holding the file, rewound to its start, or None if it was written to spill_path instead.
+    """
+    if file.file_size is not None and file.file_size <= IN_MEMORY_DOWNLOAD_MAX_MB * 1024 * 1024:
+        # The response is written straight into the buffer the consumers read from, so it is never copied.
+        buffer = io.BytesIO()
+        await file.download_to_memory(out=buffer)
+        buffer.seek(0)
+        return buffer
+    os.makedirs(os.path.dirname(spill_path), exist_ok=True)
+    await file.download_to_drive(spill_path)
+    return None
+
+def _remove_stale_downloads() -> None:
+    """Removes spill files a previous run left behind if it was killed mid-request."""
+    if not os.path.isdir(DOWNLOAD_DIR):
+        return
+    for name in os.listdir(DOWNLOAD_DIR):
+        path = os.path.join(DOWNLOAD_DIR, name)
+        if os.path.isfile(path):
+            logger.warning(f"Removing stale download: {path}")
+            os.remove(path)
+
 # --- Bot UI and Handlers ---
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -42,20 +82,21 @@ async def _process_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file
     progress_message = await update.message.reply_text(f"⏳ Đang xử lý file: {file_name}\n[10%] Đã nhận file.")
     
     file = await context.bot.get_file(file_id)
-    original_file_path = f"downloads/{file_id}_{file_name}"
-    os.makedirs(os.path.dirname(original_file_path), exist_ok=True)
+    original_file_path = f"{DOWNLOAD_DIR}/{file_id}_{file_name}"
     
     try:
         await progress_message.edit_text(f"⏳ Đang xử lý file: {file_name}\n[25%] Đang tải file xuống...")
-        await file.download_to_drive(original_file_path)
+        # Small files stay in memory; only large ones are spilled to original_file_path.
+        buffer = await _download(file, original_file_path)
+        source_path = file_name if buffer is not None else original_file_path
 
         await progress_message.edit_text(f"⏳ Đang xử lý file: {file_name}\n[50%] Đã tải xong, đang trích xuất văn bản...")
         
         # Use the best tool for the job: Gemini for visual files, unstructured for others.
         if file_name.lower().endswith(('.pdf', '.png', '.jpg', '.jpeg')):
-            full_text = await call_gemini_ocr(original_file_path)
+            full_text = await call_gemini_ocr(source_path, buffer)
         else: # For .docx, .pptx, etc.
-            full_text = await call_unstructured_partition(original_file_path)
+            full_text = await call_unstructured_partition(source_path, buffer)
 
         # CRITICAL CHECK: Stop immediately if partitioning failed.
         if full_text is None or not full_text.strip() or full_text.strip().startswith("[Error:"):
@@ -65,14 +106,15 @@ async def _process_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file
 
         await progress_message.edit_text(f"✅ Trích xuất hoàn tất. Đang xây dựng cơ sở tri thức... [75%]")
 
-        # Use a single collection per user
-        collection_name = f"user_{update.effective_user.id}"
+        # Resolve the user's collection (dedicated or shared, depending on TENANT_LAYOUT)
+        user_id = update.effective_user.id
+        collection_name = await asyncio.to_thread(get_user_collection, user_id)
         chunks = await asyncio.to_thread(chunk_text, full_text)
         
         # Create metadata for each chunk, pointing back to the source file
         metadatas = [{"source": file_name} for _ in chunks]
         
-        await asyncio.to_thread(add_to_vector_store, chunks, metadatas, collection_name)
+        stats = await asyncio.to_thread(add_to_vector_store, chunks, metadatas, collection_name, user_id)
 
         # Set user data for the chat session
         context.user_data['collection_name'] = collection_name
@@ -86,7 +128,8 @@ async def _process_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await progress_message.edit_text(            
-            f"✅ Đã thêm nội dung từ file '{file_name}' vào cơ sở tri thức của bạn. Bạn muốn làm gì tiếp theo?",
+            f"✅ Đã cập nhật nội dung từ file '{file_name}' vào cơ sở tri thức của bạn "
+            f"(+{stats['added']} / -{stats['removed']} đoạn, {stats['unchanged']} không đổi). Bạn muốn làm gì tiếp theo?",
             reply_markup=reply_markup
         )
 
@@ -164,15 +207,43 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Clears the user's knowledge base."""
-    collection_name = f"user_{update.effective_user.id}"
+    user_id = update.effective_user.id
+    collection_name = find_user_collection(user_id)
     try:
-        await asyncio.to_thread(clear_vector_store, collection_name)
+        await asyncio.to_thread(clear_vector_store, collection_name, user_id)
         context.user_data.clear()
         await update.message.reply_text("✅ Cơ sở tri thức của bạn đã được xóa sạch. Bạn có thể bắt đầu lại bằng cách gửi một tài liệu mới.")
     except Exception as e:
         logger.error(f"Error clearing collection {collection_name}: {e}")
         await update.message.reply_text("Có lỗi xảy ra khi xóa cơ sở tri thức. Có thể bạn chưa có dữ liệu nào.")
 
+async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Deletes a single document from the user's knowledge base: /delete <file name>."""
+    user_id = update.effective_user.id
+    collection_name = find_user_collection(user_id)
+    file_name = " ".join(context.args).strip() if context.args else ""
+
+    if not file_name:
+        documents = await asyncio.to_thread(list_documents, collection_name, user_id)
+        if not documents:
+            await update.message.reply_text("Cơ sở tri thức của bạn chưa có tài liệu nào.")
+            return
+        document_list = "\n".join(f"- {name}" for name in documents)
+        await update.message.reply_text(f"Dùng /delete <tên file> để xóa một tài liệu. Các tài liệu hiện có:\n{document_list}")
+        return
+
+    try:
+        removed = await asyncio.to_thread(delete_document, collection_name, file_name, user_id)
+    except Exception as e:
+        logger.error(f"Error deleting document {file_name} from {collection_name}: {e}")
+        await update.message.reply_text("Có lỗi xảy ra khi xóa tài liệu. Có thể bạn chưa có dữ liệu nào.")
+        return
+
+    if removed:
+        await update.message.reply_text(f"✅ Đã xóa tài liệu '{file_name}' ({removed} đoạn) khỏi cơ sở tri thức của bạn.")
+    else:
+        await update.message.reply_text(f"Không tìm thấy tài liệu '{file_name}' trong cơ sở tri thức của bạn.")
+
 
 
 
@@ -186,6 +257,7 @@ Tôi có thể giúp bạn với nhiều loại tệp khác nhau.
 <b>Cách sử dụng:</b>
 1.  <b>Với tài liệu (<code>.pdf</code>, <code>.docx</code>, v.v.):</b> Gửi file cho tôi, tôi sẽ trích xuất văn bản và bạn có thể yêu cầu tôi tóm tắt nội dung đó (*).
 2.  <b>Với âm thanh (file audio, tin nhắn thoại) (*):</b> Gửi file hoặc ghi âm một tin nhắn thoại, tôi sẽ chuyển đổi giọng nói thành văn bản cho bạn.
+3.  <b>Quản lý tài liệu:</b> Gửi lại một file cùng tên để cập nhật nội dung. Dùng <code>/delete &lt;tên file&gt;</code> để xóa một tài liệu, <code>/clear</code> để xóa toàn bộ.
     
 <b>Các mô hình AI hỗ trợ tóm tắt (*):</b>
 - Claude 3.5 Sonnet (Mặc định)
@@ -215,7 +287,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
 
         progress_message = await update.message.reply_text("⏳ AI đang suy nghĩ...")
-        answer = await get_rag_answer(collection_name, question, chat_history, model)
+        answer = await get_rag_answer(collection_name, question, chat_history, model, update.effective_user.id)
         
         # Update chat history
         chat_history.append(("human", question))
@@ -233,15 +305,15 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     progress_message = await update.message.reply_text(f"⏳ Đang xử lý file audio: {file_name}")
 
     file = await context.bot.get_file(audio_obj.file_id)
-    original_file_path = f"downloads/{audio_obj.file_id}_{file_name}"
-    os.makedirs(os.path.dirname(original_file_path), exist_ok=True)
+    original_file_path = f"{DOWNLOAD_DIR}/{audio_obj.file_id}_{file_name}"
 
     try:
         await progress_message.edit_text(f"⏳ Đang tải file audio: {file_name}...")
-        await file.download_to_drive(original_file_path)
+        buffer = await _download(file, original_file_path)
+        source_path = file_name if buffer is not None else original_file_path
 
         await progress_message.edit_text(f"⏳ Đã tải xong, đang gỡ băng: {file_name}...")
-        transcript = await call_openai_transcribe(original_file_path)
+        transcript = await call_openai_transcribe(source_path, buffer)
 
         final_transcript = transcript or "Không thể gỡ băng file audio này."
         await progress_message.edit_text(f"✅ Gỡ băng hoàn tất!\n\n---\n{final_transcript}")
@@ -254,15 +326,35 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         if os.path.exists(original_file_path):
             os.remove(original_file_path)
 
+async def start_background_tasks(application: Application) -> None:
+    """Cleans up after a previous run and starts the knowledge base eviction sweep alongside the bot."""
+    await asyncio.to_thread(_remove_stale_downloads)
+    if EVICTION_INTERVAL_MINUTES > 0:
+        application.bot_data['eviction_task'] = asyncio.create_task(eviction_loop())
+
+async def stop_background_tasks(application: Application) -> None:
+    """Stops background tasks and persists pending knowledge base access times."""
+    task = application.bot_data.pop('eviction_task', None)
+    if task:
+        task.cancel()
+    await asyncio.to_thread(tenant_registry.flush_access)
+
 def main() -> None:
     """Sets up the application and starts the bot polling cycle."""
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(start_background_tasks)
+        .post_shutdown(stop_background_tasks)
+        .build()
+    )
 
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("clear", clear_command))
+    application.add_handler(CommandHandler("delete", delete_command))
 
     # on non command i.e message - handle the message from user
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
@@ -0,0 +1,81 @@
+import argparse
+import re
+
+import chromadb
+
+from config import TENANT_SHARD_COUNT
+from knowledge_base import (TenantRegistry, DocumentManifest, LAYOUT_PER_USER, LAYOUT_SHARED, user_collection_name,
+                            shard_collection_name, is_shared_collection, iter_pages)
+
+USER_COLLECTION_PATTERN = re.compile(r"^user_(\d+)$")
+
+def _copy_chunks(source, target, user_id: int, batch_size: int, where=None) -> int:
+    """
+    Copies a user's chunks from one collection to another in fixed-size pages.
+    Stored embeddings are copied as-is, so nothing is re-embedded.
+    """
+    copied = 0
+    for page in iter_pages(source, batch_size, ["documents", "metadatas", "embeddings"], where=where):
+        metadatas = [{**(metadata or {}), "user_id": user_id} for metadata in page["metadatas"]]
+        target.upsert(ids=page["ids"], documents=page["documents"], metadatas=metadatas, embeddings=page["embeddings"])
+        copied += len(page["ids"])
+    return copied
+
+def migrate_to_shared(client, registry: TenantRegistry, manifest: DocumentManifest, shard_count: int, batch_size: int, dry_run: bool, keep_source: bool):
+    """Moves every per-user collection into the shared, sharded layout."""
+    for collection in client.list_collections():
+        match = USER_COLLECTION_PATTERN.match(collection.name)
+        if not match:
+            continue
+        user_id = int(match.group(1))
+        source = client.get_collection(name=collection.name)
+        target_name = shard_collection_name(user_id, shard_count)
+        print(f"{collection.name} -> {target_name} ({source.count()} chunks)")
+        if dry_run:
+            continue
+        target = client.get_or_create_collection(name=target_name, embedding_function=None)
+        copied = _copy_chunks(source, target, user_id, batch_size)
+        registry.register(user_id, target_name, LAYOUT_SHARED)
+        manifest.move(user_id, collection.name, target_name)
+        if not keep_source:
+            client.delete_collection(name=collection.name)
+        print(f"  copied {copied} chunks")
+
+def migrate_to_per_user(client, registry: TenantRegistry, manifest: DocumentManifest, batch_size: int, dry_run: bool, keep_source: bool):
+    """Splits every shared collection back into one collection per user."""
+    for collection in client.list_collections():
+        if not is_shared_collection(collection.name):
+            continue
+        source = client.get_collection(name=collection.name)
+        for user_id in registry.users_in(collection.name):
+            target_name = user_collection_name(user_id)
+            print(f"{collection.name}[user_id={user_id}] -> {target_name}")
+            if dry_run:
+                continue
+            target = client.get_or_create_collection(name=target_name, embedding_function=None)
+            copied = _copy_chunks(source, target, user_id, batch_size, where={"user_id": user_id})
+            registry.register(user_id, target_name, LAYOUT_PER_USER)
+            manifest.move(user_id, collection.name, target_name)
+            if not keep_source:
+                source.delete(where={"user_id": user_id})
+            print(f"  copied {copied} chunks")
+        if not dry_run and not keep_source and source.count() == 0:
+            client.delete_collection(name=collection.name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate user knowledge bases between tenant layouts.")
+    parser.add_argument("--to", choices=[LAYOUT_SHARED, LAYOUT_PER_USER], required=True, help="The target layout.")
+    parser.add_argument("--path", default="./chroma_data", help="The ChromaDB persistence directory.")
+    parser.add_argument("--shards", type=int, default=TENANT_SHARD_COUNT, help="Number of shared collections.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Chunks copied per page.")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would be moved.")
+    parser.add_argument("--keep-source", action="store_true", help="Do not delete the source data after copying.")
+    args = parser.parse_args()
+
+    client = chromadb.PersistentClient(path=args.path)
+    registry = TenantRegistry(f"{args.path}/tenant_registry.sqlite3")
+    manifest = DocumentManifest(f"{args.path}/document_manifest.sqlite3")
+    if args.to == LAYOUT_SHARED:
+        migrate_to_shared(client, registry, manifest, args.shards, args.batch_size, args.dry_run, args.keep_source)
+    else:
+        migrate_to_per_user(client, registry, manifest, args.batch_size, args.dry_run, args.keep_source)
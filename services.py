@@ -4,10 +4,17 @@ import os
 import httpx
 import fitz  # PyMuPDF
 import base64
+import io
+import threading
+from contextlib import contextmanager
 from typing import Optional
 
-from config import OPENROUTER_API_KEY, OPENAI_API_KEY
+from config import OPENROUTER_API_KEY, OPENAI_API_KEY, TENANT_LAYOUT, TENANT_SHARD_COUNT
+from knowledge_base import (TenantRegistry, DocumentManifest, LAYOUT_SHARED, LAYOUT_PER_USER, user_collection_name,
+                            shard_collection_name, is_shared_collection, document_id, chunk_ids, document_hash,
+                            estimate_size)
 import chromadb
+from chromadb.errors import ChromaError
 from unstructured.partition.auto import partition
 from unstructured.documents.elements import Table
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -22,22 +29,43 @@ logger = logging.getLogger(__name__)
 
 # --- RAG Configuration ---
 embedding_model = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+EMBEDDING_DIMENSION = 384  # Output size of all-MiniLM-L6-v2, used for disk usage estimates.
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
 
 # Use a persistent client to save DB to disk
 persistent_client = chromadb.PersistentClient(path="./chroma_data")
 # We will initialize the Chroma object with the specific collection name inside the functions.
 
+# Indexed user -> collection lookup, shared by both tenant layouts.
+tenant_registry = TenantRegistry("./chroma_data/tenant_registry.sqlite3")
+# Chunk ids of every stored document, used for incremental re-uploads and per-document deletes.
+document_manifest = DocumentManifest("./chroma_data/document_manifest.sqlite3")
+
+# Writes to one user's knowledge base (upload, delete, clear, eviction) are serialized
+# so that an eviction cannot interleave with an upload and leave stale manifest rows.
+_user_locks = {}
+_user_locks_guard = threading.Lock()
+
+@contextmanager
+def user_lock(collection_name: str, user_id: Optional[int] = None):
+    """Holds the write lock of a user's knowledge base (or of the collection, without a user)."""
+    key = user_id if user_id is not None else collection_name
+    with _user_locks_guard:
+        lock = _user_locks.setdefault(key, threading.RLock())
+    with lock:
+        yield
+
 GEMINI_VISION_MODEL = "google/gemini-1.5-flash"
 
 # --- Service Call Functions ---
 
-async def call_gemini_ocr(file_path: str) -> Optional[str]:
+async def call_gemini_ocr(file_path: str, buffer: Optional[io.BytesIO] = None) -> Optional[str]:
     """
     Processes a document (PDF or image) using a multimodal model (Gemini) for high-quality OCR.
 
     Args:
-        file_path: The local path to the document file to process.
+        file_path: The local path to the document file to process, or just its name when buffer is given.
+        buffer: The file's contents, if it was downloaded into memory instead of to disk.
 
     Returns:
         The extracted text content.
@@ -51,7 +79,8 @@ async def call_gemini_ocr(file_path: str) -> Optional[str]:
     try:
         # Check if the file is a PDF
         if file_path.lower().endswith('.pdf'):
-            doc = fitz.open(file_path)
+            # getbuffer() exposes the downloaded bytes without copying them.
+            doc = fitz.open(stream=buffer.getbuffer(), filetype="pdf") if buffer is not None else fitz.open(file_path)
             for page_num in range(len(doc)):
                 page = doc.load_page(page_num)
                 pix = page.get_pixmap(dpi=200) # Higher DPI for better quality
@@ -61,9 +90,12 @@ async def call_gemini_ocr(file_path: str) -> Optional[str]:
             doc.close()
         # Otherwise, assume it's an image
         else:
-            with open(file_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-                image_parts.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}})
+            if buffer is not None:
+                base64_image = base64.b64encode(buffer.getbuffer()).decode('utf-8')
+            else:
+                with open(file_path, "rb") as image_file:
+                    base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            image_parts.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}})
     except Exception as e:
         logger.error(f"Failed to pre-process file for Gemini: {e}", exc_info=True)
         return f"[Error: Failed to read file {os.path.basename(file_path)}. Details: {e!s}]"
@@ -106,13 +138,14 @@ async def call_gemini_ocr(file_path: str) -> Optional[str]:
             logger.error(f"An unexpected error occurred during Gemini OCR: {e}", exc_info=True)
             return f"[Error: Gemini OCR failed. Details: {e!s}]"
 
-async def call_unstructured_partition(file_path: str) -> Optional[str]:
+async def call_unstructured_partition(file_path: str, buffer: Optional[io.BytesIO] = None) -> Optional[str]:
     """
     Processes non-image files like .docx, .pptx using unstructured.io.
     This is a fallback for formats that don't need vision-based OCR.
 
     Args:
-        file_path: The local path to the document file to process.
+        file_path: The local path to the document file to process, or just its name when buffer is given.
+        buffer: The file's contents, if it was downloaded into memory instead of to disk.
 
     Returns:
         The extracted content as a single string. Tables are converted to HTML.
@@ -121,7 +154,11 @@ async def call_unstructured_partition(file_path: str) -> Optional[str]:
     try:
         def partition_sync():
             # Use basic strategy for text-based files
-            elements = partition(filename=file_path)
+            if buffer is not None:
+                # The file name is still passed so unstructured can detect the format from its extension.
+                elements = partition(file=buffer, metadata_filename=os.path.basename(file_path))
+            else:
+                elements = partition(filename=file_path)
             output_parts = [str(el) for el in elements if str(el).strip()]
             return "\n\n".join(output_parts)
         return await asyncio.to_thread(partition_sync)
@@ -169,13 +206,14 @@ async def call_openrouter_summarize(text: str, model: str) -> Optional[str]:
             logger.error(f"An unexpected error occurred during summarization: {e}")
             return f"[Error: Summarization failed. Details: {e}]"
 
-async def call_openai_transcribe(file_path: str) -> Optional[str]:
+async def call_openai_transcribe(file_path: str, buffer: Optional[io.BytesIO] = None) -> Optional[str]:
     """
     Transcribes an audio file using the OpenAI Whisper API.
     Uses httpx for non-blocking asynchronous requests.
 
     Args:
-        file_path: The local path to the audio file to transcribe.
+        file_path: The local path to the audio file to transcribe, or just its name when buffer is given.
+        buffer: The file's contents, if it was downloaded into memory instead of to disk.
 
     Returns:
         The transcribed text as a string, or an error/skip message.
@@ -188,7 +226,7 @@ async def call_openai_transcribe(file_path: str) -> Optional[str]:
     transport = httpx.AsyncHTTPTransport(retries=3)
     async with httpx.AsyncClient(timeout=180.0, transport=transport) as client:
         try:
-            with open(file_path, "rb") as audio_file:
+            with (buffer if buffer is not None else open(file_path, "rb")) as audio_file:
                 files = {'file': (os.path.basename(file_path), audio_file), 'model': (None, 'whisper-1')}
                 response = await client.post("https://api.openai.com/v1/audio/transcriptions", headers={"Authorization": f"Bearer {OPENAI_API_KEY}"}, files=files)
             response.raise_for_status()
@@ -210,49 +248,223 @@ def chunk_text(text: str) -> list:
     logger.info(f"Chunking text of length {len(text)}...")
     return text_splitter.split_text(text)
 
-def add_to_vector_store(chunks: list, metadatas: list, collection_name: str):
-    """Adds text chunks to a specific collection in the persistent vector store."""
+def _collection_exists(collection_name: str) -> bool:
+    """Checks for a single collection by name, without listing the whole store."""
+    try:
+        persistent_client.get_collection(name=collection_name)
+        return True
+    except (ValueError, ChromaError):
+        return False
+
+def get_user_collection(user_id: int) -> str:
+    """
+    Resolves the collection holding a user's knowledge base.
+    Users are assigned a collection on first use and the assignment is kept in the
+    tenant registry, so later lookups are O(1) and stay stable even if the layout or
+    shard count changes. A user without a registration who already has a user_<id>
+    collection (from before the registry existed) keeps it; everyone else is placed
+    according to TENANT_LAYOUT.
+    """
+    collection_name = tenant_registry.get(user_id)
+    if collection_name is None:
+        legacy_name = user_collection_name(user_id)
+        if _collection_exists(legacy_name):
+            tenant_registry.register(user_id, legacy_name, LAYOUT_PER_USER)
+            return legacy_name
+        if TENANT_LAYOUT == LAYOUT_SHARED:
+            collection_name = shard_collection_name(user_id, TENANT_SHARD_COUNT)
+        else:
+            collection_name = legacy_name
+        tenant_registry.register(user_id, collection_name, TENANT_LAYOUT)
+    return collection_name
+
+def find_user_collection(user_id: int) -> str:
+    """
+    Returns the collection a user's knowledge base lives in without registering them.
+    Unknown users resolve to their legacy per-user collection, which may not exist.
+    """
+    return tenant_registry.get(user_id) or user_collection_name(user_id)
+
+def add_to_vector_store(chunks: list, metadatas: list, collection_name: str, user_id: Optional[int] = None) -> dict:
+    """
+    Upserts text chunks into a specific collection in the persistent vector store.
+    Chunks are grouped into documents by their "source" metadata and given deterministic ids,
+    so re-uploading a document only embeds new chunks and removes the ones that disappeared.
+    When a user_id is given it is stamped on every chunk so shared collections can be filtered per user.
+
+    Returns:
+        Counts of chunks that were added, removed and left unchanged.
+    """
+    if user_id is not None:
+        # Recorded before waiting for the lock, so a pending eviction sees the user as active.
+        tenant_registry.touch(user_id)
+    with user_lock(collection_name, user_id):
+        return _add_to_vector_store(chunks, metadatas, collection_name, user_id)
+
+def _add_to_vector_store(chunks: list, metadatas: list, collection_name: str, user_id: Optional[int] = None) -> dict:
+    stats = {"added": 0, "removed": 0, "unchanged": 0}
     if not chunks:
         logger.warning("No chunks provided to create vector store.")
-        return
+        return stats
     
     if len(chunks) != len(metadatas):
         logger.error("Mismatch between number of chunks and metadatas. Aborting.")
-        return
+        return stats
+
+    documents = {}
+    for chunk, metadata in zip(chunks, metadatas):
+        documents.setdefault(metadata["source"], []).append((chunk, metadata))
     
     # Initialize Chroma with the specific collection for adding texts
     vector_store_for_add = Chroma(
         client=persistent_client, collection_name=collection_name, embedding_function=embedding_model
     )
-    logger.info(f"Adding {len(chunks)} chunks with metadata to collection '{collection_name}'...")
-    vector_store_for_add.add_texts(texts=chunks, metadatas=metadatas)
+    collection = persistent_client.get_collection(name=collection_name)
+    for source, items in documents.items():
+        doc_chunks = [chunk for chunk, _ in items]
+        doc_id = document_id(source, user_id)
+        ids = chunk_ids(doc_id, doc_chunks)
+        doc_hash = document_hash(doc_chunks)
+        extra_metadata = {"doc_id": doc_id}
+        if user_id is not None:
+            extra_metadata["user_id"] = user_id
+
+        previous = document_manifest.get(collection_name, source, user_id)
+        if previous and not collection.get(ids=previous["chunk_ids"][:1], include=[])["ids"]:
+            # The manifest outlived its chunks (e.g. the collection was dropped and recreated); re-ingest.
+            logger.warning(f"Chunks of '{source}' are missing from collection '{collection_name}', re-ingesting.")
+            previous = None
+        if previous and previous["content_hash"] == doc_hash:
+            logger.info(f"Document '{source}' is unchanged in collection '{collection_name}', skipping.")
+            stats["unchanged"] += len(ids)
+            continue
+
+        if previous:
+            existing_ids = set(previous["chunk_ids"])
+            stale_ids = sorted(existing_ids - set(ids))
+        else:
+            # Chunks stored before the manifest existed have random ids; find them by source.
+            existing_ids = set()
+            legacy_ids = collection.get(where=_document_filter(collection_name, source, user_id), include=[])["ids"]
+            stale_ids = sorted(set(legacy_ids) - set(ids))
+
+        new_items = [(chunk_id, chunk, metadata) for chunk_id, (chunk, metadata) in zip(ids, items)
+                     if chunk_id not in existing_ids]
+        if new_items:
+            logger.info(f"Upserting {len(new_items)} of {len(ids)} chunks of '{source}' into collection '{collection_name}'...")
+            vector_store_for_add.add_texts(
+                texts=[chunk for _, chunk, _ in new_items],
+                metadatas=[{**metadata, **extra_metadata} for _, _, metadata in new_items],
+                ids=[chunk_id for chunk_id, _, _ in new_items]
+            )
+        # Remove chunks that no longer exist only once the new revision is stored.
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+        document_manifest.put(collection_name, source, doc_id, doc_hash, ids, user_id,
+                              estimate_size(doc_chunks, EMBEDDING_DIMENSION))
+
+        stats["added"] += len(new_items)
+        stats["removed"] += len(stale_ids)
+        stats["unchanged"] += len(ids) - len(new_items)
+    return stats
+
+def _document_filter(collection_name: str, source: str, user_id: Optional[int] = None) -> dict:
+    """Builds the Chroma `where` filter matching one document's chunks."""
+    if is_shared_collection(collection_name):
+        if user_id is None:
+            raise ValueError(f"Collection '{collection_name}' is shared and requires a user_id.")
+        return {"$and": [{"source": source}, {"user_id": user_id}]}
+    return {"source": source}
+
+def delete_document(collection_name: str, source: str, user_id: Optional[int] = None) -> int:
+    """
+    Deletes a single document's chunks from a collection.
+
+    Returns:
+        The number of chunks removed.
+    """
+    with user_lock(collection_name, user_id):
+        return _delete_document(collection_name, source, user_id)
 
-def clear_vector_store(collection_name: str):
-    """Clears all documents from a specific user's collection."""
+def _delete_document(collection_name: str, source: str, user_id: Optional[int] = None) -> int:
+    logger.info(f"Deleting document '{source}' from collection '{collection_name}'...")
+    try:
+        collection = persistent_client.get_collection(name=collection_name)
+    except (ValueError, ChromaError):
+        logger.warning(f"Collection '{collection_name}' does not exist; forgetting document '{source}'.")
+        document_manifest.remove(collection_name, source, user_id)
+        return 0
+    entry = document_manifest.get(collection_name, source, user_id)
+    if entry:
+        ids = entry["chunk_ids"]
+        collection.delete(ids=ids)
+        removed = len(ids)
+    else:
+        where = _document_filter(collection_name, source, user_id)
+        removed = len(collection.get(where=where, include=[])["ids"])
+        collection.delete(where=where)
+    document_manifest.remove(collection_name, source, user_id)
+    return removed
+
+def list_documents(collection_name: str, user_id: Optional[int] = None) -> list[str]:
+    """Lists the names of the documents stored in a user's knowledge base."""
+    return document_manifest.sources(collection_name, user_id)
+
+def clear_vector_store(collection_name: str, user_id: Optional[int] = None):
+    """
+    Clears all documents from a specific user's collection.
+    In a shared collection only the given user's chunks are removed.
+    A collection that no longer exists is not an error: its manifest and registry rows are still dropped.
+    """
+    with user_lock(collection_name, user_id):
+        _clear_vector_store(collection_name, user_id)
+
+def _clear_vector_store(collection_name: str, user_id: Optional[int] = None):
     logger.info(f"Clearing all documents from collection '{collection_name}'...")
-    persistent_client.delete_collection(name=collection_name)
+    if is_shared_collection(collection_name) and user_id is None:
+        raise ValueError(f"Refusing to clear shared collection '{collection_name}' without a user_id.")
+    try:
+        if is_shared_collection(collection_name):
+            persistent_client.get_collection(name=collection_name).delete(where={"user_id": user_id})
+        else:
+            persistent_client.delete_collection(name=collection_name)
+    except (ValueError, ChromaError):
+        logger.warning(f"Collection '{collection_name}' does not exist; dropping its bookkeeping only.")
+    document_manifest.clear(collection_name, user_id)
+    if user_id is not None:
+        tenant_registry.remove(user_id)
 
 def list_collections(user_id: int) -> list[str]:
     """Lists all collections for a given user."""
-    all_collections = persistent_client.list_collections()
-    user_prefix = f"user_{user_id}_"
-    return [c.name for c in all_collections if c.name.startswith(user_prefix)]
+    collection_name = tenant_registry.get(user_id)
+    return [collection_name] if collection_name else []
 
 def delete_collection(collection_name: str):
-    """Deletes a specific collection from the database."""
+    """Deletes a specific collection from the database, along with its manifest and registry rows."""
     logger.info(f"Deleting collection '{collection_name}'...")
     persistent_client.delete_collection(name=collection_name)
+    document_manifest.clear_collection(collection_name)
+    tenant_registry.remove_collection(collection_name)
 
-async def get_rag_answer(collection_name: str, question: str, chat_history: list, model: str) -> str:
+async def get_rag_answer(collection_name: str, question: str, chat_history: list, model: str,
+                         user_id: Optional[int] = None) -> str:
     """
     Gets an answer to a question using the RAG pipeline.
+    In a shared collection, retrieval is restricted to the given user's chunks.
     """
     logger.info(f"Getting RAG answer for question: '{question}'")
+    if user_id is not None:
+        tenant_registry.touch(user_id)
 
     vector_store = Chroma(
         client=persistent_client, collection_name=collection_name, embedding_function=embedding_model
     )
-    retriever = vector_store.as_retriever()
+    search_kwargs = {}
+    if is_shared_collection(collection_name):
+        if user_id is None:
+            return f"[Error: Collection '{collection_name}' is shared and requires a user_id.]"
+        search_kwargs["filter"] = {"user_id": user_id}
+    retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
 
     # --- 1. Standalone Question Generation Chain ---
     # This chain condenses the chat history and new question into a single, standalone question.